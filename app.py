@@ -1,11 +1,12 @@
 import streamlit as st
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import matplotlib.patches as patches
+from matplotlib.collections import PatchCollection
 from typing import List, Tuple
 import itertools
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from itertools import combinations
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+import numpy as np
 import tempfile
 import io
 import os
@@ -13,6 +14,8 @@ from reportlab.lib.pagesizes import landscape, letter
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import cm
 
+from packing_core import pack_slab
+
 st.set_page_config(layout="wide")
 
 # Light mode only settings
@@ -45,53 +48,80 @@ st.markdown(f"""
 
 st.title("SLAB OPTIMIZATION")
 
-def can_fit_any_rotation(piece: Tuple[float, float], space: Tuple[float, float]) -> Tuple[bool, Tuple[float, float]]:
-    pw, ph = piece
-    sw, sh = space
-    for orientation in [(pw, ph), (ph, pw)]:
-        if orientation[0] <= sw and orientation[1] <= sh:
-            return True, orientation
-    return False, (0, 0)
+def can_fit_any_rotation(pw: float, ph: float, sw: float, sh: float) -> bool:
+    # Fits one way or the other iff short side <= short side and long <= long
+    return min(pw, ph) <= min(sw, sh) and max(pw, ph) <= max(sw, sh)
 
 def guillotine_split(free_spaces: List[Tuple[float, float, float, float]],
                      pw: float, ph: float) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+    # Best short side fit: take the free space (and orientation) that leaves the
+    # least room along its tighter side, the smaller space on ties, and the
+    # given orientation over the rotated one when both score the same
+    best = None
     for i, (fx, fy, fw, fh) in enumerate(free_spaces):
-        fits, orientation = can_fit_any_rotation((pw, ph), (fw, fh))
-        if fits:
-            ow, oh = orientation
-            px, py = fx, fy
-            new_spaces = []
-            new_spaces.append((fx + ow, fy, fw - ow, oh))
-            new_spaces.append((fx, fy + oh, fw, fh - oh))
-            free_spaces.pop(i)
-            for s in new_spaces:
-                if s[2] > 0 and s[3] > 0:
-                    free_spaces.append(s)
-            return (px, py), orientation
-    return None, None
+        for ow, oh in ((pw, ph), (ph, pw)):
+            if ow <= fw and oh <= fh:
+                score = (min(fw - ow, fh - oh), fw * fh)
+                if best is None or score < best[0]:
+                    best = (score, i, ow, oh)
+    if best is None:
+        return None, None
+
+    _, i, ow, oh = best
+    fx, fy, fw, fh = free_spaces[i]
+    # Reuse slot i for the first remainder and append the second, or move
+    # the last space into it, rather than popping i and shifting the tail
+    remainders = [space for space in ((fx + ow, fy, fw - ow, oh), (fx, fy + oh, fw, fh - oh))
+                  if space[2] > 0 and space[3] > 0]
+    if remainders:
+        free_spaces[i] = remainders[0]
+        free_spaces.extend(remainders[1:])
+    else:
+        free_spaces[i] = free_spaces[-1]
+        free_spaces.pop()
+    return (fx, fy), (ow, oh)
+
+def fits_free_space(free_spaces: List[Tuple[float, float, float, float]], pw: float, ph: float) -> bool:
+    # Whether guillotine_split would find a space for the piece at all
+    return any(can_fit_any_rotation(pw, ph, fw, fh) for _, _, fw, fh in free_spaces)
+
+def bounded_combinations(items: list, counts: dict, r: int, start: int = 0):
+    # Same sequence combinations() gives over a list holding counts[item] copies
+    # of each item (copies next to each other), minus the repeats
+    if r == 0:
+        yield ()
+        return
+    for i in range(start, len(items)):
+        item = items[i]
+        counts[item] -= 1
+        for rest in bounded_combinations(items, counts, r - 1, i if counts[item] else i + 1):
+            yield (item,) + rest
+        counts[item] += 1
 
 def sort_pieces(pieces: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
     return sorted(pieces, key=lambda x: x[0] * x[1], reverse=True)
 
 def sort_pieces_min_waste_hybrid(pieces, slabs):
-    def fit_stats(piece):
-        pw, ph = piece[1], piece[2]
-        fitting_slabs = 0
-        best_waste_ratio = float('inf')
-        for sw, sh in slabs:
-            slab_area = sw * sh
-            for dims in [(pw, ph), (ph, pw)]:
-                if dims[0] <= sw and dims[1] <= sh:
-                    fitting_slabs += 1
-                    waste_ratio = (slab_area - (dims[0] * dims[1])) / slab_area
-                    best_waste_ratio = min(best_waste_ratio, waste_ratio)
-        return fitting_slabs, best_waste_ratio
+    if not pieces:
+        return []
+
+    # Fit statistics for every (piece, slab) pair in one vectorized pass
+    dims = np.array([(p[1], p[2]) for p in pieces], dtype=np.float64)
+    slab_dims = np.array(slabs, dtype=np.float64).reshape(-1, 2)
+    pw, ph = dims[:, 0:1], dims[:, 1:2]
+    sw, sh = slab_dims[:, 0], slab_dims[:, 1]
+    piece_area = dims[:, 0] * dims[:, 1]
+    slab_area = sw * sh
+
+    fits_normal = (pw <= sw) & (ph <= sh)
+    fits_rotated = (ph <= sw) & (pw <= sh)
+    fitting_slabs = fits_normal.sum(axis=1) + fits_rotated.sum(axis=1)
+    waste_ratio = (slab_area - piece_area[:, None]) / slab_area
+    best_waste_ratio = np.where(fits_normal | fits_rotated, waste_ratio, np.inf).min(axis=1, initial=np.inf)
 
     # Sort by fewest fitting slabs, then lowest waste ratio, then largest area
-    return sorted(
-        pieces,
-        key=lambda p: (fit_stats(p)[0], fit_stats(p)[1], -(p[1] * p[2]))
-    )
+    order = np.lexsort((-piece_area, best_waste_ratio, fitting_slabs))
+    return [pieces[i] for i in order]
 
 def try_combo(required_pieces: List[Tuple[str, float, float]], combo: List[Tuple[float, float]]):
     results = []
@@ -124,6 +154,31 @@ def try_combo(required_pieces: List[Tuple[str, float, float]], combo: List[Tuple
 
     return results, pieces, used_slabs
 
+@st.cache_resource
+def get_combo_executor() -> ThreadPoolExecutor:
+    # One pool shared by every run; starting threads on each click costs more
+    # than evaluating the combos themselves
+    return ThreadPoolExecutor()
+
+class SlabState:
+    # Granite bookkeeping for one physical slab; slots keep the per-piece
+    # attribute access in the best-fit loop cheap
+    __slots__ = ("index", "size", "area", "free_spaces", "layout", "used_area")
+
+    def __init__(self, index: int, sw: float, sh: float):
+        self.index = index
+        self.size = (sw, sh)
+        self.area = sw * sh
+        self.free_spaces = [(0, 0, sw, sh)]
+        self.layout = []
+        self.used_area = 0
+
+def hash_as_tuple(items: list) -> int:
+    # Cached inputs are flat lists of hashable tuples; hashing them as one tuple
+    # is far cheaper than Streamlit's element-by-element hasher
+    return hash(tuple(items))
+
+@st.cache_data(show_spinner=False, hash_funcs={list: hash_as_tuple})
 def nest_pieces_guillotine(required_pieces: List[Tuple[str, float, float]], available_slabs: List[Tuple[float, float]], use_smart_combo: bool = True, granite_mode: bool = False):
     def sort_slabs(slabs):
         return sorted(slabs, key=lambda x: x[0] * x[1])
@@ -133,10 +188,7 @@ def nest_pieces_guillotine(required_pieces: List[Tuple[str, float, float]], avai
 
     if granite_mode:
         # --- Remove duplicate slab sizes (only 1 physical slab per entry) ---
-        unique_slabs = []
-        for slab in available_slabs:
-            if slab not in unique_slabs:
-                unique_slabs.append(slab)
+        unique_slabs = list(dict.fromkeys(available_slabs))
     
         results = []
         used_slabs = []
@@ -149,51 +201,70 @@ def nest_pieces_guillotine(required_pieces: List[Tuple[str, float, float]], avai
             sw, sh = slab
             if sh > sw:
                 sw, sh = sh, sw
-            slab_states.append({
-                "size": (sw, sh),
-                "free_spaces": [(0, 0, sw, sh)],
-                "layout": [],
-                "used_area": 0
-            })
+            slab_states.append(SlabState(len(slab_states), sw, sh))
+
+        # Whether each piece fits each empty slab in some orientation, worked out
+        # once up front; a slab it can't fit whole has no free space that fits it
+        piece_sides = np.sort(np.array([(w, h) for _, w, h in pieces], dtype=np.float64).reshape(-1, 2), axis=1)
+        slab_sides = np.array([s.size[::-1] for s in slab_states], dtype=np.float64).reshape(-1, 2)
+        fits = ((piece_sides[:, None, 0] <= slab_sides[None, :, 0]) &
+                (piece_sides[:, None, 1] <= slab_sides[None, :, 1])).tolist()
+        piece_fits = {piece: row for piece, row in zip(pieces, fits)}
     
         leftovers = []
+
+        # Slabs whose free spaces can no longer hold even the smallest piece
+        # are dropped from the best-fit scan for good (free spaces only shrink)
+        min_short = min((min(w, h) for _, w, h in pieces), default=0)
+        min_long = min((max(w, h) for _, w, h in pieces), default=0)
+        open_states = list(slab_states)
+    
+        # Free area across all slabs, kept up to date as pieces are placed
+        remaining_area = sum(s.area for s in slab_states)
     
         # --- Best Fit Decreasing with tie-breaker --
-        for name, pw, ph in pieces:
+        for piece in pieces:
+            name, pw, ph = piece
+            slab_fits = piece_fits[piece]
             # Optimization #2: Early stop check
-            remaining_area = sum(s["size"][0] * s["size"][1] - s["used_area"] for s in slab_states)
             if remaining_area < pw * ph:
                 leftovers.append((name, pw, ph))
                 continue
     
             best_slab = None
-            best_slab_pos = None
-            best_slab_dim = None
             min_waste = float('inf')
     
-            for slab_state in slab_states:
-                for dims in [(pw, ph), (ph, pw)]:
-                    # Make a copy of free spaces to test fit
-                    test_spaces = list(slab_state["free_spaces"])
-                    pos, dim = guillotine_split(test_spaces, *dims)
-                    if pos:
-                        used_area_after = slab_state["used_area"] + dim[0] * dim[1]
-                        slab_area = slab_state["size"][0] * slab_state["size"][1]
-                        waste = slab_area - used_area_after
-    
-                        # Optimization #3: Tie-breaker on waste
-                        if (waste < min_waste) or (
-                            waste == min_waste and best_slab and max(slab_state["size"]) < max(best_slab["size"])
-                        ):
-                            min_waste = waste
-                            best_slab = slab_state
-                            best_slab_pos = pos
-                            best_slab_dim = dim
+            for slab_state in open_states:
+                if not slab_fits[slab_state.index]:
+                    continue
+                # Free spaces partition the unused area, so a slab with less of it
+                # than the piece cannot take the piece in any free space
+                if slab_state.area - slab_state.used_area < pw * ph:
+                    continue
+                # Probe in place: waste only depends on the piece area, so all
+                # that matters is whether some free space takes the piece either
+                # way round; no scratch copy or per-orientation split is needed
+                if not fits_free_space(slab_state.free_spaces, pw, ph):
+                    continue
+                used_area_after = slab_state.used_area + pw * ph
+                slab_area = slab_state.area
+                waste = slab_area - used_area_after
+
+                # Optimization #3: Tie-breaker on waste
+                if (waste < min_waste) or (
+                    waste == min_waste and best_slab and max(slab_state.size) < max(best_slab.size)
+                ):
+                    min_waste = waste
+                    best_slab = slab_state
     
             if best_slab:
-                guillotine_split(best_slab["free_spaces"], *best_slab_dim)
-                best_slab["layout"].append((name, best_slab_pos, best_slab_dim))
-                best_slab["used_area"] += best_slab_dim[0] * best_slab_dim[1]
+                pos, dim = guillotine_split(best_slab.free_spaces, pw, ph)
+                best_slab.layout.append((name, pos, dim))
+                best_slab.used_area += dim[0] * dim[1]
+                remaining_area -= dim[0] * dim[1]
+                if not any(min(fw, fh) >= min_short and max(fw, fh) >= min_long
+                           for _, _, fw, fh in best_slab.free_spaces):
+                    open_states.remove(best_slab)
             else:
                 leftovers.append((name, pw, ph))
 
@@ -202,13 +273,15 @@ def nest_pieces_guillotine(required_pieces: List[Tuple[str, float, float]], avai
             new_leftovers = []
             for name, pw, ph in leftovers:
                 placed = False
+                slab_fits = piece_fits[(name, pw, ph)]
                 for slab_state in slab_states:
-                    pos, dim = guillotine_split(slab_state["free_spaces"], pw, ph)
-                    if not pos:  # Try rotated
-                        pos, dim = guillotine_split(slab_state["free_spaces"], ph, pw)
+                    if not slab_fits[slab_state.index]:
+                        continue
+                    # guillotine_split already tries the rotated piece
+                    pos, dim = guillotine_split(slab_state.free_spaces, pw, ph)
                     if pos:
-                        slab_state["layout"].append((name, pos, dim))
-                        slab_state["used_area"] += dim[0] * dim[1]
+                        slab_state.layout.append((name, pos, dim))
+                        slab_state.used_area += dim[0] * dim[1]
                         placed = True
                         break
                 if not placed:
@@ -222,13 +295,15 @@ def nest_pieces_guillotine(required_pieces: List[Tuple[str, float, float]], avai
             gap_filled_leftovers = []
             for name, pw, ph in leftovers:
                 placed = False
+                slab_fits = piece_fits[(name, pw, ph)]
                 for slab_state in slab_states:
-                    pos, dim = guillotine_split(slab_state["free_spaces"], pw, ph)
-                    if not pos:
-                        pos, dim = guillotine_split(slab_state["free_spaces"], ph, pw)
+                    if not slab_fits[slab_state.index]:
+                        continue
+                    # guillotine_split already tries the rotated piece
+                    pos, dim = guillotine_split(slab_state.free_spaces, pw, ph)
                     if pos:
-                        slab_state["layout"].append((name, pos, dim))
-                        slab_state["used_area"] += dim[0] * dim[1]
+                        slab_state.layout.append((name, pos, dim))
+                        slab_state.used_area += dim[0] * dim[1]
                         placed = True
                         break
                 if not placed:
@@ -237,53 +312,77 @@ def nest_pieces_guillotine(required_pieces: List[Tuple[str, float, float]], avai
 
     
         # --- Build results ---
+        total_used_area = 0
+        total_piece_area = 0
         for slab_state in slab_states:
-            if slab_state["layout"]:
-                results.append((slab_state["size"], slab_state["layout"]))
-                used_slabs.append(slab_state["size"])
+            if slab_state.layout:
+                results.append((slab_state.size, slab_state.layout))
+                used_slabs.append(slab_state.size)
+                total_used_area += slab_state.area
+                total_piece_area += slab_state.used_area
     
-        return results, leftovers, used_slabs
+        return results, leftovers, used_slabs, total_used_area, total_piece_area
 
 
     else:
         # Quartz mode (smart combo or regular)
-        def try_combo(required_pieces: List[Tuple[str, float, float]], combo: List[Tuple[float, float]]):
+        # Packing a slab only depends on its size and the ordered remaining pieces,
+        # and combos share those states constantly, so pack each one only once.
+        # Each packing state gets a small integer id, and the state after a slab
+        # is keyed by (previous id, slab) instead of a fresh tuple of every
+        # remaining piece per slab
+        pack_cache = {}
+        start_states = {}
+        state_ids = itertools.count()
+
+        def try_combo(required_pieces: List[Tuple[str, float, float]], combo: List[Tuple[float, float]], pre_sorted: bool = False):
             results = []
             used_slabs = []
-            pieces = sort_pieces_min_waste_hybrid(required_pieces, combo)
+            used_area = 0
+            piece_area = 0
+            pieces = required_pieces if pre_sorted else sort_pieces_min_waste_hybrid(required_pieces, combo)
+            pieces_wh = None
+            state = start_states.setdefault(tuple(pieces), next(state_ids))
 
             for slab in combo:
                 sw, sh = slab
                 if sh > sw:
                     sw, sh = sh, sw
 
-                layout = []
-                free_spaces = [(0, 0, sw, sh)]
-                still_needed = []
-
-                for name, pw, ph in pieces:
-                    pos, dim = guillotine_split(free_spaces, pw, ph)
-                    if pos:
-                        layout.append((name, pos, dim))
-                    else:
-                        still_needed.append((name, pw, ph))
-
+                key = (state, sw, sh)
+                cached = pack_cache.get(key)
+                if cached is None:
+                    if pieces_wh is None:
+                        pieces_wh = np.array([(pw, ph) for _, pw, ph in pieces], dtype=np.float64).reshape(-1, 2)
+
+                    # Native guillotine pass over all remaining pieces for this slab
+                    positions, dims_arr, placed = pack_slab(pieces_wh, float(sw), float(sh))
+                    positions, dims = positions.tolist(), dims_arr.tolist()
+                    layout = [
+                        (pieces[i][0], tuple(positions[i]), tuple(dims[i]))
+                        for i in np.flatnonzero(placed)
+                    ]
+                    still_needed = [piece for piece, ok in zip(pieces, placed) if not ok]
+                    placed_area = float((dims_arr[:, 0] * dims_arr[:, 1])[placed].sum())
+                    cached = pack_cache[key] = (layout, still_needed, pieces_wh[~placed], next(state_ids), placed_area)
+
+                layout, pieces, pieces_wh, state, placed_area = cached
                 if layout:
                     results.append(((sw, sh), layout))
                     used_slabs.append((sw, sh))
-                pieces = still_needed
+                    used_area += sw * sh
+                    piece_area += placed_area
 
                 if not pieces:
                     break
 
-            return results, pieces, used_slabs
+            return results, pieces, used_slabs, used_area, piece_area
 
-        def try_combo_wrapped(combo):
-            # Calculate total area of this combo in m²
-            combo_area = sum((w / 100) * (h / 100) for w, h in combo)  # m²
+        def try_combo_wrapped(combo, combo_area):
+            # combo_area (cm²) is already computed by the enumeration loop
         
             # 1️⃣ Area-based repeats (ensures enough total surface area)
-            area_based_repeats = -(- (required_area / 10000) / combo_area)  # ceiling division
+            area_based_repeats = -(- required_area / combo_area)  # ceiling division
         
             # 2️⃣ Count-based repeats (ensures enough individual slabs for large pieces)
             count_based_repeats = max(len(required_pieces) // len(combo), 1)
@@ -294,80 +393,158 @@ def nest_pieces_guillotine(required_pieces: List[Tuple[str, float, float]], avai
             # Repeat slabs enough times to fit all pieces
             combo_list = list(combo) * min_repeats
         
-            results, leftovers, used = try_combo(required_pieces, combo_list)
+            # Repeating the combo scales every fit count equally, so the piece order
+            # from the unrepeated combo is the same and far cheaper to compute
+            pieces = sort_pieces_min_waste_hybrid(required_pieces, combo)
+            result = try_combo(pieces, combo_list, pre_sorted=True)
+            results, leftovers, used, used_area, piece_area = result
         
             if not leftovers:
-                used_area = sum(w * h for w, h in used)
                 wastage = used_area - required_area
-                return (wastage, len(used)), (results, leftovers, used)
+                return (wastage, len(used)), result
         
             return (float('inf'), float('inf')), None
 
         if not use_smart_combo:
             return try_combo(required_pieces, available_slabs)
 
+        # Slabs are packed long side first, so "60 320" and "320 60" are one size
+        slab_sizes = [(max(slab), min(slab)) for slab in sorted_slabs]
+
+        # Bitmask of the pieces each slab size can hold in either orientation,
+        # computed once per size instead of once per combo. Piece short/long
+        # sides are sorted once, then each (long, short) size is one compare
+        piece_sides = np.sort(np.array([(w, h) for _, w, h in required_pieces], dtype=np.float64).reshape(-1, 2), axis=1)
+        fit_masks = {}
+        for slab in set(slab_sizes):
+            fits = (piece_sides[:, 0] <= slab[1]) & (piece_sides[:, 1] <= slab[0])
+            fit_masks[slab] = sum(1 << i for i in np.flatnonzero(fits).tolist())
+
+        # A slab size that cannot hold any piece never gets a layout, so leave it
+        # out of the combos instead of multiplying the search space by it
+        candidate_slabs = [slab for slab in slab_sizes if fit_masks[slab]]
+
+        # A piece no slab size can hold would make every combo fail; report it as
+        # a leftover and search for the best layout of the pieces that can fit
+        placeable = 0
+        for mask in fit_masks.values():
+            placeable |= mask
+        oversized = [piece for i, piece in enumerate(required_pieces) if not placeable >> i & 1]
+        if oversized:
+            required_pieces = [piece for i, piece in enumerate(required_pieces) if placeable >> i & 1]
+            required_area = sum(w * h for _, w, h in required_pieces)
+
         best_result = None
         min_wastage = (float('inf'), float('inf'))  # (wastage, slab_count)
 
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for r in range(1, min(len(sorted_slabs), 5) + 1):
-                for combo in combinations(sorted_slabs, r):
-                    slab_area = sum(w * h for w, h in combo)
-                    if slab_area < required_area:
-                        continue
-                    futures.append(executor.submit(try_combo_wrapped, combo))
+        executor = get_combo_executor()
+        futures = []
+        # Combos are multisets of the distinct sizes, each used at most as often
+        # as it is listed; picking a repeated size from another position would
+        # only pack the same combo again
+        slab_counts = Counter(candidate_slabs)
+        unique_slabs = list(slab_counts)
+        slab_areas = {slab: slab[0] * slab[1] for slab in unique_slabs}  # cm², once per size
+        for r in range(1, min(len(candidate_slabs), 5) + 1):
+            for combo in bounded_combinations(unique_slabs, slab_counts, r):
+                slab_area = sum(slab_areas[slab] for slab in combo)
+                if slab_area < required_area:
+                    continue
+                # Cheap bound before packing: a piece that fits none of the combo's
+                # slabs is always left over, so the combo can never succeed
+                combo_mask = 0
+                for slab in combo:
+                    combo_mask |= fit_masks[slab]
+                if combo_mask != placeable:
+                    continue
+                futures.append(executor.submit(try_combo_wrapped, combo, slab_area))
+
+        # No layout wastes less than nothing or uses fewer slabs than the largest
+        # size needs on area alone; once a combo hits that, nothing later can
+        # beat it, so the combos still queued are dropped
+        max_slab_area = max(slab_areas.values(), default=0)
+        best_possible = (0, -(-required_area // max_slab_area)) if max_slab_area else None
+
+        # Reduce in submission order so ties resolve the same way on every run
+        for future in futures:
+            wastage, result = future.result()
+            if result:
+                (waste, slab_count) = wastage
+                (best_waste, best_slab_count) = min_wastage
+
+                # Choose less waste, or fewer slabs if waste is equal
+                if waste < best_waste or (waste == best_waste and slab_count < best_slab_count):
+                    min_wastage = (waste, slab_count)
+                    best_result = result
+
+                if min_wastage == best_possible:
+                    for pending in futures:
+                        pending.cancel()
+                    break
 
-            for future in as_completed(futures):
-                wastage, result = future.result()
-                if result:
-                    (waste, slab_count) = wastage
-                    (best_waste, best_slab_count) = min_wastage
+        if not best_result:
+            return [], required_pieces + oversized, [], 0, 0
+        results, leftovers, used_slabs, used_area, piece_area = best_result
+        return results, leftovers + oversized, used_slabs, used_area, piece_area
+        
 
-                    # Choose less waste, or fewer slabs if waste is equal
-                    if waste < best_waste or (waste == best_waste and slab_count < best_slab_count):
-                        min_wastage = (waste, slab_count)
-                        best_result = result
+def add_piece_collection(ax, layout: list):
+    # One collection for all pieces instead of one patch artist per piece
+    rects = [patches.Rectangle((x, y), w, h) for _, (x, y), (w, h) in layout]
+    ax.add_collection(PatchCollection(rects, edgecolor='black', facecolor=piece_color))
 
-        return best_result if best_result else ([], required_pieces, [])
-        
 
-def draw_slab_layout(slab: tuple, layout: list):
+def piece_label(name: str, w: float, h: float) -> str:
+    size = f"{int(min(w, h))}x{int(max(w, h))}"
+    name = name.strip()
+    return f"{name}\n{size}" if name else size
+
+
+@st.cache_data(show_spinner=False, hash_funcs={list: hash_as_tuple})
+def render_slab_layout(slab: tuple, layout: list, max_labels: int = 30) -> bytes:
     sw, sh = slab
     fig_width = 10
     fig_height = max(5, fig_width * (sh / sw))  # Ensure minimum figure height for thin slabs
-    fig, ax = plt.subplots(figsize=(fig_width, fig_height))
+    fig = Figure(figsize=(fig_width, fig_height))
+    ax = fig.subplots()
     ax.add_patch(patches.Rectangle((0, 0), sw, sh, edgecolor='black', facecolor=slab_color))
 
-    for label, (x, y), (w, h) in layout:
-        label = label.strip()
-        if label:
-            piece_label = f"{label}\n{int(min(w, h))}x{int(max(w, h))}"
-        else:
-            piece_label = f"{int(min(w, h))}x{int(max(w, h))}"
-
-        # Dynamically compute font size
-        max_font = 12
-        min_font = 6
-        font_size = max(min(w, h) // 10, min_font)
-        font_size = min(font_size, max_font)
-
-        ax.add_patch(patches.Rectangle((x, y), w, h, edgecolor='black', facecolor=piece_color))
-        ax.text(
-            x + w / 2, y + h / 2,
-            piece_label,
-            ha='center', va='center',
-            fontsize=font_size,
-            fontweight='bold',
-            color='black',
-            multialignment='center'
-        )
+    add_piece_collection(ax, layout)
+
+    # Text layout is the expensive part of a figure; on crowded slabs the
+    # labels overlap anyway, so only draw them while they can be read
+    if len(layout) <= max_labels:
+        for label, (x, y), (w, h) in layout:
+            # Dynamically compute font size
+            max_font = 12
+            min_font = 6
+            font_size = max(min(w, h) // 10, min_font)
+            font_size = min(font_size, max_font)
+
+            ax.text(
+                x + w / 2, y + h / 2,
+                piece_label(label, w, h),
+                ha='center', va='center',
+                fontsize=font_size,
+                fontweight='bold',
+                color='black',
+                multialignment='center'
+            )
 
     ax.set_xlim(0, sw)
     ax.set_ylim(0, sh)
     ax.set_aspect('equal')  # Maintain proper aspect ratio for positioning
     ax.axis('off')
-    st.pyplot(fig)
+
+    # Rasterize ourselves at screen resolution; st.pyplot encodes at 200 dpi
+    img_buf = io.BytesIO()
+    fig.savefig(img_buf, format='png', dpi=100, bbox_inches='tight')
+    return img_buf.getvalue()
+
+
+def draw_slab_layout(slab: tuple, layout: list):
+    # Reruns with an unchanged layout reuse the cached PNG instead of redrawing
+    st.image(render_slab_layout(slab, layout))
 
 
 def generate_pdf_report(results, total_used_area, total_piece_area, used_slabs, leftovers):
@@ -387,18 +564,15 @@ def generate_pdf_report(results, total_used_area, total_piece_area, used_slabs,
             sw, sh = slab
             fig_width = 28
             fig_height = fig_width * (sh / sw)
-            fig, ax = plt.subplots(figsize=(fig_width, fig_height))
+            fig = Figure(figsize=(fig_width, fig_height))
+            ax = fig.subplots()
             ax.add_patch(patches.Rectangle((0, 0), sw, sh, edgecolor='black', facecolor=slab_color))
 
-            for label, (x, y), (w, h) in layout:
-                label = label.strip()
-                if label:
-                    label_text = f"{label}\n{int(min(w, h))}x{int(max(w, h))}"
-                else:
-                    label_text = f"{int(min(w, h))}x{int(max(w, h))}"
+            add_piece_collection(ax, layout)
 
+            for label, (x, y), (w, h) in layout:
+                label_text = piece_label(label, w, h)
                 font_size = min(max(min(w, h) // 26, 26), 26)
-                ax.add_patch(patches.Rectangle((x, y), w, h, edgecolor='black', facecolor=piece_color))
                 ax.text(
                     x + w / 2, y + h / 2, label_text,
                     ha='center', va='center',
@@ -414,7 +588,6 @@ def generate_pdf_report(results, total_used_area, total_piece_area, used_slabs,
 
             img_buf = io.BytesIO()
             fig.savefig(img_buf, format='png', dpi=300, bbox_inches='tight', pad_inches=0.05)
-            plt.close(fig)
 
             img_path = os.path.join(tmpdirname, f"layout_{i}.png")
             with open(img_path, 'wb') as f:
@@ -489,6 +662,47 @@ def generate_pdf_report(results, total_used_area, total_piece_area, used_slabs,
         with open(pdf_path, "rb") as f:
             st.session_state["pdf_bytes"] = f.read()
 
+def parse_required_pieces(text: str) -> List[Tuple[str, float, float]]:
+    # "name w h" or "w h" per line, in m; returned in cm. The m -> cm product is
+    # snapped to 0.1 mm so e.g. 0.07 m is exactly 7 cm, not 7.000000000000001,
+    # and still fits a 7 cm gap
+    pieces = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 3:
+            name, w, h = parts
+        elif len(parts) == 2:
+            name, (w, h) = "", parts
+        else:
+            continue
+        try:
+            pieces.append((name, round(float(w) * 100, 2), round(float(h) * 100, 2)))
+        except ValueError:
+            raise ValueError(f"Invalid piece line: '{line.strip()}'")
+    return pieces
+
+def parse_slabs(text: str) -> List[Tuple[float, float]]:
+    # "w h" per line, in cm; blank lines are ignored. Purely numeric, so the
+    # whole block goes through NumPy's C parser in one call
+    if not text.strip():
+        return []
+    try:
+        arr = np.loadtxt(io.StringIO(text), dtype=np.float64, ndmin=2)
+    except ValueError:
+        arr = None
+    if arr is None or arr.shape[1] != 2:
+        # Slow path only to name the offending line
+        for line in text.splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            try:
+                w, h = map(float, parts)
+            except ValueError:
+                raise ValueError(f"Invalid slab line: '{line.strip()}'")
+        raise ValueError("Invalid slab input")
+    return [(w, h) for w, h in arr.tolist()]
+
 # --- Input & UI ---
 with st.expander("📐 Input Dimensions", expanded=True):
     col1, col2 = st.columns(2)
@@ -497,30 +711,20 @@ with st.expander("📐 Input Dimensions", expanded=True):
     with col2:
         slab_input = st.text_area("Available slabs (in cm)", "60 320\n70 320\n80 320\n90 320\n100 320\n160 320")
 
-# --- Calculate required pieces area ---
-required_area_preview = 0
-piece_count = 0
-for line in req_input.strip().splitlines():
-    parts = line.strip().split()
-    if len(parts) == 3:
-        _, w, h = parts[0], float(parts[1]), float(parts[2])
-    elif len(parts) == 2:
-        w, h = float(parts[0]), float(parts[1])
-    else:
-        continue
-    required_area_preview += w * h
-    piece_count += 1
-
-# --- Calculate available slabs area ---
-available_area_preview = 0
-slab_count = 0
-for line in slab_input.strip().splitlines():
-    try:
-        w, h = map(float, line.strip().split())
-        available_area_preview += (w / 100) * (h / 100)  # convert cm² → m²
-        slab_count += 1
-    except:
-        continue
+# --- Parse inputs once per rerun ---
+input_error = None
+try:
+    required = parse_required_pieces(req_input)
+    available = parse_slabs(slab_input)
+except ValueError as e:
+    required, available = [], []
+    input_error = str(e)
+    st.error(f"❌ {input_error}")
+
+required_area_preview = sum(w * h for _, w, h in required) / 10000  # cm² → m²
+piece_count = len(required)
+available_area_preview = sum(w * h for w, h in available) / 10000  # cm² → m²
+slab_count = len(available)
 
 with st.sidebar:
     # --- Settings in a collapsible menu ---
@@ -545,33 +749,15 @@ with st.sidebar:
         shortage = required_area_preview - available_area_preview
         st.error(f"❌ Need {shortage:.2f} m² more")
 
-if st.button("⚙️ Nest Slabs"):
+if st.button("⚙️ Nest Slabs") and not input_error:
     try:
-        required = []
-        for line in req_input.strip().splitlines():
-            parts = line.strip().split()
-            if len(parts) == 3:
-                name, w, h = parts[0], float(parts[1]), float(parts[2])
-            elif len(parts) == 2:
-                name, w, h = "", float(parts[0]), float(parts[1])
-            else:
-                continue
-            required.append((name, w * 100, h * 100))
-
-        available = []
-        for line in slab_input.strip().splitlines():
-            w, h = map(float, line.strip().split())
-            available.append((w, h))
-
-        results, leftovers, used_slabs = nest_pieces_guillotine(
+        # Slab and piece area totals come back with the (cached) layout
+        results, leftovers, used_slabs, total_used_area, total_piece_area = nest_pieces_guillotine(
             required, available, 
             use_smart_combo=smart_combo,
             granite_mode=(mode == "Granite")
         )
 
-        total_used_area = sum(slab[0] * slab[1] for slab, _ in results)
-        total_piece_area = sum(w * h for _, layout in results for (_, _, (w, h)) in layout)
-
         st.session_state["results"] = results
         st.session_state["leftovers"] = leftovers
         st.session_state["used_slabs"] = used_slabs
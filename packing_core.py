@@ -0,0 +1,110 @@
+import numpy as np
+from numba import njit
+
+
+# Explicit signature: compiled (or loaded from the on-disk cache) when the
+# module is imported, not on the first call
+@njit("Tuple((float64[:, ::1], float64[:, ::1], boolean[::1]))(float64[:, ::1], float64, float64)",
+      cache=True, nogil=True)
+def pack_slab(pieces_wh, sw, sh):
+    """Guillotine-pack pieces, in order, into a single sw x sh slab.
+
+    Native port of running ``guillotine_split`` for every piece on a fresh
+    slab: each piece goes into the free rectangle and orientation with the
+    best short side fit, and that rectangle is split into a right and a top
+    remainder.
+
+    Returns ``(positions, dims, placed)`` where row ``i`` of ``positions`` /
+    ``dims`` holds the (x, y) and placed (w, h) of piece ``i`` whenever
+    ``placed[i]`` is True.
+
+    Compiled with ``nogil`` so the smart-combo thread pool can run several
+    slab passes at once.
+    """
+    n = pieces_wh.shape[0]
+    positions = np.zeros((n, 2), dtype=np.float64)
+    dims = np.zeros((n, 2), dtype=np.float64)
+    placed = np.zeros(n, dtype=np.bool_)
+
+    # Every placement consumes one free rectangle and adds at most two
+    free = np.empty((n + 1, 4), dtype=np.float64)
+    free[0, 0] = 0.0
+    free[0, 1] = 0.0
+    free[0, 2] = sw
+    free[0, 3] = sh
+    n_free = 1
+
+    # Splits only ever shrink the free rectangles, so once a piece fails in
+    # this slab, any piece at least as large in both sides fails as well.
+    # Runs of identical pieces are adjacent after sorting and skip the scan.
+    fail_min = np.inf
+    fail_max = np.inf
+
+    for p in range(n):
+        pw = pieces_wh[p, 0]
+        ph = pieces_wh[p, 1]
+        if min(pw, ph) >= fail_min and max(pw, ph) >= fail_max:
+            continue
+
+        # Best short side fit: the free rectangle (and orientation) leaving the
+        # smallest leftover along its tighter side, smaller rectangle on ties
+        i = -1
+        best_short = np.inf
+        best_area = np.inf
+        ow = 0.0
+        oh = 0.0
+        for k in range(n_free):
+            fw = free[k, 2]
+            fh = free[k, 3]
+            for rot in range(2):
+                cw, ch = (pw, ph) if rot == 0 else (ph, pw)
+                if cw > fw or ch > fh:
+                    continue
+                short = min(fw - cw, fh - ch)
+                area = fw * fh
+                if short < best_short or (short == best_short and area < best_area):
+                    i = k
+                    best_short = short
+                    best_area = area
+                    ow = cw
+                    oh = ch
+
+        if i < 0:
+            fail_min = min(pw, ph)
+            fail_max = max(pw, ph)
+            continue
+
+        fx = free[i, 0]
+        fy = free[i, 1]
+        fw = free[i, 2]
+        fh = free[i, 3]
+        has_right = fw - ow > 0 and oh > 0
+        has_top = fw > 0 and fh - oh > 0
+
+        # The first remainder takes over slot i and a second goes on the
+        # end; with no remainder the last rectangle moves into slot i.
+        # Either way nothing after i is shifted down
+        if has_right:
+            free[i, 0] = fx + ow
+            free[i, 1] = fy
+            free[i, 2] = fw - ow
+            free[i, 3] = oh
+        if has_top:
+            slot = n_free if has_right else i
+            free[slot, 0] = fx
+            free[slot, 1] = fy + oh
+            free[slot, 2] = fw
+            free[slot, 3] = fh - oh
+            if has_right:
+                n_free += 1
+        if not has_right and not has_top:
+            n_free -= 1
+            free[i, :] = free[n_free, :]
+
+        positions[p, 0] = fx
+        positions[p, 1] = fy
+        dims[p, 0] = ow
+        dims[p, 1] = oh
+        placed[p] = True
+
+    return positions, dims, placed